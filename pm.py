@@ -1,30 +1,46 @@
+import csv
+import gzip
+import pickle
 import subprocess
 from platform import system
 from sys import stdout
 from enum import Enum
-from collections import Counter
-from datetime import timedelta
-from os import path, makedirs, listdir
-from matplotlib import pyplot
-from pandas import DataFrame, read_csv
+from hashlib import blake2b
+from array import array
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from itertools import islice, repeat
+from datetime import timedelta, timezone
+from os import path, makedirs, listdir, replace, getpid, linesep
+from numpy import asarray, argsort, arange, concatenate, flatnonzero, fromiter, isnan, nan
+from numpy import searchsorted, sort, unique, where
+from pandas import DataFrame, Series, factorize, read_csv, isna
 from time import process_time
 from tempfile import TemporaryDirectory
-from pm4py import read_bpmn, read_pnml
-from pm4py.objects.log.obj import EventLog, Trace
-from pm4py.objects.log.importer.xes import importer as xes_importer
-from pm4py.objects.log.exporter.xes import exporter as xes_exporter
-from pm4py.objects.conversion.log import converter as log_converter
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import quoteattr
+from pm4py import read_bpmn, read_pnml, __version__ as pm4py_version
+from pm4py.objects.log.obj import EventLog, Trace, Event
+from pm4py.util.dt_parsing import parser as dt_parser
 from pm4py.objects.conversion.bpmn import converter as bpmn_converter
 from pm4py.objects.petri_net.exporter import exporter as pnml_exporter
-from pm4py.streaming.importer.csv import importer as csv_stream_importer
 from pm4py.algo.discovery.inductive import algorithm as inductive_miner
+from pm4py.algo.conformance.alignments.petri_net import algorithm as alignments
 from pm4py.algo.evaluation.replay_fitness import algorithm as fitness_evaluator
 from pm4py.algo.evaluation.precision import algorithm as precision_evaluator
 from pm4py.visualization.petri_net import visualizer as pn_visualizer
 
-CASE_ID_KEY = 'case:concept:name'
+CASE_PREFIX = 'case:'
+CASE_ID_KEY = CASE_PREFIX + 'concept:name'
 ACTIVITY_KEY = 'concept:name'
 FINAL_ACTIVITY = '_END_'
+CHUNK_SIZE = 100000
+TRACE_TYPECODE = 'H'
+HISTOGRAM_BARS = 10000
+EVALUATION_BATCH = 64
+EVALUATION_BACKLOG = 16 * EVALUATION_BATCH
+SUMMARY_TAIL = 4096
+DISCOVERY_SCRIPT = path.join('scripts', 'run.bat' if system() == 'Windows' else 'run.sh')
 
 
 class Algo(Enum):
@@ -39,33 +55,225 @@ class Order(Enum):
     MAX = 3
 
 
+def read_xes_traces(xes_path, keys=None):
+    """
+    Legge in modo incrementale un log di eventi in formato XES (eventualmente compresso), rilasciando ciascuna traccia
+    dopo averla restituita
+    :param xes_path: percorso del file XES
+    :param keys: insieme degli attributi da leggere (None per leggere tutti gli attributi)
+    :return: generatore di coppie formate dagli attributi di una traccia e dalla lista degli attributi dei suoi eventi
+    """
+    with gzip.open(xes_path) if xes_path.endswith('.gz') else open(xes_path, 'rb') as file:
+        context = iterparse(file, events=('start', 'end'))
+        _, root = next(context)
+        for event, element in context:
+            if event == 'end' and element.tag.rpartition('}')[2] == 'trace':
+                attributes, trace = {}, []
+                for child in element:
+                    if child.tag.rpartition('}')[2] == 'event':
+                        trace.append({attribute.get('key'): attribute.get('value') for attribute in child
+                                      if keys is None or attribute.get('key') in keys})
+                    elif keys is None or child.get('key') in keys:
+                        attributes[child.get('key')] = child.get('value')
+                if trace:
+                    yield attributes, trace
+                root.clear()
+
+
+def write_xes(traces, xes_path):
+    """
+    Esporta in formato XES un insieme di tracce, serializzando una sola volta ciascuna traccia ripetuta
+    :param traces: coppie formate dalla sequenza di attività di una traccia e dal relativo numero di occorrenze
+    :param xes_path: percorso del file XES da generare
+    """
+    with open(xes_path, 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="utf-8" ?>\n<log xes.version="1849-2016" '
+                   'xes.features="nested-attributes" xmlns="http://www.xes-standard.org/">\n')
+        for trace, occurrence in traces:
+            events = ''.join(f'\t\t<event>\n\t\t\t<string key="{ACTIVITY_KEY}" value={quoteattr(activity)} />\n'
+                             f'\t\t</event>\n' for activity in trace)
+            file.write(f'\t<trace>\n{events}\t</trace>\n' * occurrence)
+        file.write('</log>\n')
+
+
+def build_trace(trace, events):
+    """
+    Costruisce una traccia pm4py a partire da una sequenza di attività, condividendo un unico evento per ciascuna
+    attività. Gli eventi vengono soltanto letti dagli algoritmi impiegati
+    :param trace: sequenza di attività della traccia
+    :param events: dizionario degli eventi già costruiti, indicizzati per attività
+    :return: traccia pm4py
+    """
+    for activity in trace:
+        if activity not in events:
+            events[activity] = Event({ACTIVITY_KEY: activity})
+    return Trace(events[activity] for activity in trace)
+
+
+def discover_model(traces, algo, filtering, cache_path=None):
+    """
+    Genera un modello di processo a partire dalle tracce fornite in input, tramite l'algoritmo selezionato. Il modello
+    viene memorizzato nel percorso indicato, così da essere riutilizzato senza invocare nuovamente l'algoritmo
+    :param traces: coppie formate dalla sequenza di attività di una traccia e dal relativo numero di occorrenze
+    :param algo: algoritmo di process discovery da impiegare
+    :param filtering: booleano per l'applicazione del filtraggio del rumore
+    :param cache_path: percorso del file in cui memorizzare il modello (None per non memorizzarlo)
+    :return: rete di Petri con marcatura iniziale e finale
+    """
+    if cache_path is not None and path.isfile(cache_path):
+        with open(cache_path, 'rb') as file:
+            return pickle.load(file)
+    if algo == Algo.IND:
+        log, events = EventLog(), {}
+        for trace, occurrence in traces:
+            trace = build_trace(trace, events)
+            for i in range(occurrence):
+                log.append(trace)
+        variant = inductive_miner.Variants.IMf if filtering else inductive_miner.Variants.IM
+        model = inductive_miner.apply(log, variant=variant)
+    else:
+        with TemporaryDirectory() as temp:
+            log_path = path.join(temp, 'log.xes')
+            write_xes(traces, log_path)
+            model_path = path.join(temp, 'model.bpmn' if algo == Algo.SPL else 'model.pnml')
+            args = (DISCOVERY_SCRIPT, algo.name, str(filtering), log_path, path.splitext(model_path)[0])
+            returncode = subprocess.call(args, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, args)
+            if not path.isfile(model_path):
+                raise FileNotFoundError(f'Model not generated by {DISCOVERY_SCRIPT}: {model_path}')
+            if algo == Algo.SPL:
+                model = bpmn_converter.apply(read_bpmn(model_path))
+            else:
+                model = read_pnml(model_path)
+    if cache_path is not None:
+        temp_path = f'{cache_path}.{getpid()}'
+        with open(temp_path, 'wb') as file:
+            pickle.dump(model, file)
+        replace(temp_path, cache_path)
+    return model
+
+
+def timed_discovery(traces, algo, filtering, cache_path=None):
+    """
+    Genera un modello di processo tramite discover_model, misurando il tempo di CPU impiegato dal processo che esegue
+    l'algoritmo
+    :param traces: coppie formate dalla sequenza di attività di una traccia e dal relativo numero di occorrenze
+    :param algo: algoritmo di process discovery da impiegare
+    :param filtering: booleano per l'applicazione del filtraggio del rumore
+    :param cache_path: percorso del file in cui memorizzare il modello (None per non memorizzarlo)
+    :return: rete di Petri con marcatura iniziale e finale e tempo di CPU impiegato
+    """
+    start = process_time()
+    model = discover_model(traces, algo, filtering, cache_path)
+    return model, process_time() - start
+
+
+def evaluate_trace(trace, model, max_length=None, fitness=None):
+    """
+    Valuta un modello di processo su una singola istanza tramite allineamenti. Le istanze più lunghe della soglia
+    indicata vengono valutate tramite token-based replay, il cui costo cresce linearmente con la lunghezza
+    :param trace: sequenza di attività dell'istanza da impiegare nella valutazione
+    :param model: rete di Petri con marcatura iniziale e finale
+    :param max_length: lunghezza massima delle istanze valutate tramite allineamenti (None per nessun limite)
+    :param fitness: fitness basata sugli allineamenti, se già calcolata (None per calcolarla)
+    :return: fitness e precision del modello sull'istanza
+    """
+    log = EventLog([build_trace(trace, {})])
+    if max_length is not None and len(trace) > max_length:
+        variant = fitness_evaluator.Variants.TOKEN_BASED
+        parameters = {variant.value.Parameters.SHOW_PROGRESS_BAR: False}
+        fitness = fitness_evaluator.apply(log, *model, variant=variant, parameters=parameters)['average_trace_fitness']
+        variant = precision_evaluator.Variants.ETCONFORMANCE_TOKEN
+    else:
+        if fitness is None:
+            variant = fitness_evaluator.Variants.ALIGNMENT_BASED
+            fitness = fitness_evaluator.apply(log, *model, variant=variant)['average_trace_fitness']
+        variant = precision_evaluator.Variants.ALIGN_ETCONFORMANCE
+    parameters = {variant.value.Parameters.SHOW_PROGRESS_BAR: False}
+    precision = precision_evaluator.apply(log, *model, variant=variant, parameters=parameters)
+    return fitness, precision
+
+
+def evaluate_traces(traces, model, max_length=None):
+    """
+    Valuta un modello di processo su un insieme di istanze, calcolando con un'unica invocazione gli allineamenti di
+    quelle non più lunghe della soglia indicata, così da verificare la rete e determinarne il costo minimo una sola
+    volta. La precisione viene calcolata separatamente per ciascuna istanza, mentre la f-measure è calcolata
+    sull'intero insieme, nulla per le istanze con fitness nulla
+    :param traces: sequenze di attività delle istanze da impiegare nella valutazione
+    :param model: rete di Petri con marcatura iniziale e finale
+    :param max_length: lunghezza massima delle istanze valutate tramite allineamenti (None per nessun limite)
+    :return: lista di fitness, precision e f-measure del modello su ciascuna istanza
+    """
+    aligned = [trace for trace in traces if max_length is None or len(trace) <= max_length]
+    aligned_fitness = {}
+    if aligned:
+        events = {}
+        log = EventLog([build_trace(trace, events) for trace in aligned])
+        parameters = {alignments.Parameters.SHOW_PROGRESS_BAR: False}
+        for trace, alignment in zip(aligned, alignments.apply(log, *model, parameters=parameters)):
+            aligned_fitness[trace] = 0.0 if alignment is None else float(alignment['fitness'])
+    scores = [evaluate_trace(trace, model, max_length, aligned_fitness.get(trace)) for trace in traces]
+    fitness, precision = asarray(scores, dtype=float).reshape(-1, 2).T
+    fitting = fitness != 0
+    f_measure = where(fitting, 2 * fitness * precision / where(fitting, fitness + precision, 1.0), 0.0)
+    return list(zip(fitness.tolist(), precision.tolist(), f_measure.tolist()))
+
+
+def timed_evaluation(traces, model, max_length=None):
+    """
+    Valuta un modello di processo su un insieme di istanze, misurando il tempo di CPU impiegato dal processo che esegue
+    la valutazione
+    :param traces: sequenze di attività delle istanze da impiegare nella valutazione
+    :param model: rete di Petri con marcatura iniziale e finale
+    :param max_length: lunghezza massima delle istanze valutate tramite allineamenti (None per nessun limite)
+    :return: lista di fitness, precision e f-measure del modello su ciascuna istanza e tempo di CPU impiegato
+    """
+    start = process_time()
+    evaluations = evaluate_traces(traces, model, max_length)
+    return evaluations, process_time() - start
+
+
 class Miner:
 
     @staticmethod
     def generate_csv(log_name, case_id=CASE_ID_KEY, activity=ACTIVITY_KEY, timestamp='time:timestamp'):
         """
         Converte il file XES in input in uno stream di eventi ordinati cronologicamente con formato CSV. Ogni traccia
-        viene estesa con un evento conclusivo che ne definisca il termine
+        viene estesa con un evento conclusivo, successivo all'ultimo istante registrato, che ne definisca il termine.
+        Lo stream già generato viene riutilizzato, evitando la lettura del log XES, finché quest'ultimo non risulta
+        modificato successivamente
         :param log_name: nome del file XES (eventualmente compresso) contenente il log di eventi
         :param case_id: attributo identificativo dell'istanza di processo (con aggiunta del prefisso 'case:')
         :param activity: attributo identificativo dell'attività eseguita
         :param timestamp: attributo indicante l'istante di esecuzione di un evento
         """
         csv_path = path.join('eventlog', 'CSV', log_name + '.csv')
-        if not path.isfile(csv_path):
+        xes_path = path.join('eventlog', 'XES', log_name)
+        xes_path += '.xes.gz' if path.isfile(xes_path + '.xes.gz') else '.xes'
+        if not path.isfile(csv_path) or path.isfile(xes_path) and path.getmtime(xes_path) > path.getmtime(csv_path):
             print('Generating CSV file from XES log...')
-            xes_path = path.join('eventlog', 'XES', log_name)
-            xes_path += '.xes.gz' if path.isfile(xes_path + '.xes.gz') else '.xes'
-            log = xes_importer.apply(xes_path, variant=xes_importer.Variants.LINE_BY_LINE)
-            for trace in log:
-                trace.append({activity: FINAL_ACTIVITY, timestamp: trace[-1][timestamp] + timedelta(seconds=1)})
-            dataframe = log_converter.apply(log, variant=log_converter.Variants.TO_DATA_FRAME)
-            dataframe = dataframe.filter(items=[activity, timestamp, case_id]).sort_values(timestamp, kind='mergesort')
-            dataframe = dataframe.rename(columns={activity: ACTIVITY_KEY, case_id: CASE_ID_KEY})
+            date_parser = dt_parser.get()
+            case_attribute = case_id[len(CASE_PREFIX):] if case_id.startswith(CASE_PREFIX) else case_id
+            activities, times, cases = [], [], []
+            for attributes, trace in read_xes_traces(xes_path, {case_attribute, activity, timestamp}):
+                trace_times = [date_parser.apply(event[timestamp]) for event in trace]
+                activities.extend(event[activity] for event in trace)
+                activities.append(FINAL_ACTIVITY)
+                times.extend(trace_times)
+                times.append(max(trace_times) + timedelta(seconds=1))
+                cases.extend(repeat(attributes[case_attribute], len(trace) + 1))
+            keys = fromiter((time.replace(tzinfo=time.tzinfo or timezone.utc).timestamp() for time in times),
+                            dtype=float, count=len(times))
             makedirs(path.dirname(csv_path), exist_ok=True)
-            dataframe.to_csv(csv_path, index=False)
+            with open(csv_path, 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file, lineterminator=linesep)
+                writer.writerow((ACTIVITY_KEY, timestamp, CASE_ID_KEY))
+                writer.writerows((activities[i], times[i], cases[i]) for i in argsort(keys, kind='stable').tolist())
 
-    def __init__(self, log_name, order, algo, cut, top, filtering, frequency, update):
+    def __init__(self, log_name, order, algo, cut, top, filtering, frequency, update, workers=None, max_length=None,
+                 cache=False):
         """
         Metodo costruttore
         :param log_name: nome del file CSV contenente lo stream di eventi
@@ -76,6 +284,13 @@ class Miner:
         :param filtering: booleano per l'utilizzo di tecniche di filtering
         :param frequency: booleano per l'utilizzo delle frequenze nella costruzione del modello
         :param update: booleano per l'apprendimento dinamico del modello
+        :param workers: numero di processi da dedicare all'apprendimento e alla valutazione, il cui tempo di CPU viene
+        comunque attribuito alle istanze (None per l'esecuzione sequenziale)
+        :param max_length: lunghezza oltre la quale le istanze vengono valutate tramite token-based replay anziché
+        tramite allineamenti, riportata nel nome dei file dei risultati (None per valutare ogni istanza tramite
+        allineamenti)
+        :param cache: booleano per memorizzare su disco i modelli appresi tramite SPL e ILP, riutilizzandoli in
+        esecuzioni successive i cui tempi non risultano quindi confrontabili
         """
         self.log_name = log_name
         self.order = order
@@ -85,13 +300,123 @@ class Miner:
         self.filtering = filtering
         self.frequency = frequency
         self.update = update
+        self.max_length = max_length
+        self.cache = cache
+        top_variants = 'P' if top is None else top
+        setup = f"{'UFL' if filtering else 'NFL'}.{'UFR' if frequency else 'NFR'}.{'D' if update else 'S'}"
+        setup += '' if max_length is None else f'.L{max_length}'
+        self.file = f'{order.name}.{algo.name}.{cut}.{top_variants}.{setup}'
         self.processed_traces = 0
         self.variants = Counter()
+        self.variant_ids = {}
+        self.variants_by_length = {}
+        self.ranked_variants = []
         self.best_variants = None
         self.models = []
+        self.learned_models = {}
+        self.pending_discoveries = set()
         self.drift_moments = []
         self.drift_variants = []
-        self.evaluations = []
+        self.evaluations = deque()
+        self.evaluation_cache = {}
+        self.model_evaluations = None
+        self.pending_evaluations = []
+        self.pending_rows = 0
+        self.step_start = None
+        self.evaluation_file = None
+        self.evaluation_writer = None
+        self.exported_evaluations = 0
+        self.exported_scores = Counter()
+        self.exported_time = 0.0
+        self.pool = ProcessPoolExecutor(workers) if workers else None
+        self.activities = [FINAL_ACTIVITY]
+        self.activity_codes = {FINAL_ACTIVITY: 0}
+
+    def encode_activities(self, activities):
+        """
+        Converte le attività fornite in input nei rispettivi codici interi, registrando le attività non ancora note.
+        Il numero di attività distinte non può eccedere i codici rappresentabili con TRACE_TYPECODE
+        :param activities: serie categorica contenente le attività da codificare
+        :return: array dei codici associati alle attività
+        """
+        for activity in activities.cat.categories:
+            if activity not in self.activity_codes:
+                self.activity_codes[activity] = len(self.activities)
+                self.activities.append(activity)
+        if len(self.activities) > 1 << 8 * array(TRACE_TYPECODE).itemsize:
+            raise ValueError(f'Too many distinct activities: {len(self.activities)}')
+        codes = asarray([self.activity_codes[activity] for activity in activities.cat.categories])
+        return codes[activities.cat.codes.to_numpy()]
+
+    def decode_variant(self, variant):
+        """
+        Ricostruisce la sequenza di attività di una variante a partire dai rispettivi codici
+        :param variant: sequenza di byte dei codici delle attività che compongono la variante
+        :return: tupla delle attività che compongono la variante
+        """
+        codes = array(TRACE_TYPECODE)
+        codes.frombytes(variant)
+        return tuple(self.activities[code] for code in codes)
+
+    @staticmethod
+    def variant_length(variant):
+        """
+        Calcola la lunghezza di una variante codificata
+        :param variant: sequenza di byte dei codici delle attività che compongono la variante
+        :return: numero di attività che compongono la variante
+        """
+        return len(variant) // array(TRACE_TYPECODE).itemsize
+
+    def split_chunk(self, chunk):
+        """
+        Suddivide un blocco dello stream nei segmenti di ciascuna istanza delimitati dagli eventi finali, scartando in
+        modo vettoriale le ripetizioni precedute, nello stesso blocco, da due occorrenze della medesima attività
+        :param chunk: blocco dello stream contenente gli identificativi delle istanze e le relative attività
+        :return: generatore di terne formate dall'identificativo di un'istanza, dalla sequenza di byte dei codici delle
+        attività del segmento e da un booleano che indica se il segmento conclude l'istanza. I segmenti conclusivi
+        sono restituiti nell'ordine dei rispettivi eventi finali, seguiti da quelli delle istanze ancora aperte
+        """
+        indices, cases = factorize(chunk[CASE_ID_KEY])
+        activities = self.encode_activities(chunk[ACTIVITY_KEY])
+        groups = Series(activities).groupby(indices, sort=False)
+        ends = activities == self.activity_codes[FINAL_ACTIVITY]
+        repeated = (groups.shift(1).to_numpy() == activities) & (groups.shift(2).to_numpy() == activities)
+        closing = Series(where(ends, arange(len(ends)), nan)).groupby(indices, sort=False).bfill().to_numpy()
+        closing = where(isnan(closing), len(ends) + indices, closing)
+        rows = flatnonzero(~ends & ~repeated)
+        order = rows[argsort(closing[rows], kind='stable')]
+        keys = closing[order]
+        closed_rows = flatnonzero(ends)
+        open_cases = unique(keys[keys >= len(ends)]).astype(int) - len(ends)
+        segments = concatenate((closed_rows, open_cases + len(ends)))
+        starts = searchsorted(keys, segments, side='left')
+        stops = searchsorted(keys, segments, side='right')
+        closed = segments < len(ends)
+        owners = cases[concatenate((indices[closed_rows], open_cases))].tolist()
+        buffer = activities[order].astype(TRACE_TYPECODE).tobytes()
+        size = array(TRACE_TYPECODE).itemsize
+        for case, start, stop, end in zip(owners, (starts * size).tolist(), (stops * size).tolist(), closed.tolist()):
+            yield case, buffer[start:stop], end
+
+    @staticmethod
+    def join_segment(trace, segment):
+        """
+        Accoda un segmento a un'istanza aperta, scartando le prime attività del segmento che proseguano una ripetizione
+        già presente al termine dell'istanza. Se la prima attività del segmento differisce dall'ultima dell'istanza,
+        nessuna ripetizione può proseguire e i due vengono concatenati direttamente
+        :param trace: sequenza di byte dei codici delle attività dell'istanza aperta
+        :param segment: sequenza di byte dei codici delle attività del segmento
+        :return: sequenza di byte dei codici delle attività dell'istanza estesa
+        """
+        leading = array(TRACE_TYPECODE)
+        if segment[:leading.itemsize] != trace[-leading.itemsize:]:
+            return trace + segment
+        previous = memoryview(trace).cast(TRACE_TYPECODE)[-2:].tolist()
+        for activity in memoryview(segment).cast(TRACE_TYPECODE)[:2].tolist():
+            if previous[-2:] != [activity, activity]:
+                leading.append(activity)
+                previous.append(activity)
+        return trace + leading.tobytes() + segment[2 * leading.itemsize:]
 
     def process_stream(self):
         """
@@ -101,22 +426,39 @@ class Miner:
         un modello di processo. Tale modello sarà valutato su ciascuna delle istanze successive
         """
         print('Processing event stream...')
-        stream = csv_stream_importer.apply(path.join('eventlog', 'CSV', self.log_name + '.csv'))
+        csv_path = path.join('eventlog', 'CSV', self.log_name + '.csv')
+        folder = path.join('results', self.log_name, 'evaluation')
+        makedirs(folder, exist_ok=True)
+        evaluation_path = path.join(folder, f'{self.file}.csv.{getpid()}')
+        self.evaluation_file = open(evaluation_path, 'w', encoding='utf-8', buffering=1 << 20)
+        self.evaluation_writer = csv.writer(self.evaluation_file, lineterminator='\n')
+        self.evaluation_writer.writerow(['n°_evaluation', 'fitness', 'precision', 'f-measure', 'time'])
         traces = {}
-        start = process_time()
-        for event in stream:
-            case = event[CASE_ID_KEY]
-            activity = event[ACTIVITY_KEY]
-            if activity == FINAL_ACTIVITY:
-                new_trace = tuple(traces.pop(case))
+        self.step_start = process_time()
+        options = {'usecols': [CASE_ID_KEY, ACTIVITY_KEY], 'dtype': 'category', 'memory_map': True, 'engine': 'c'}
+        for chunk in read_csv(csv_path, chunksize=CHUNK_SIZE, **options):
+            for case, segment, closed in self.split_chunk(chunk):
+                trace = traces.pop(case, None)
+                if trace is not None:
+                    segment = self.join_segment(trace, segment)
+                if not closed:
+                    traces[case] = segment
+                    continue
+                new_trace = segment
                 self.variants[new_trace] += 1
+                if new_trace not in self.variant_ids:
+                    self.variant_ids[new_trace] = len(self.variant_ids)
+                    self.variants_by_length.setdefault(self.variant_length(new_trace), []).append(new_trace)
+                if self.top is not None:
+                    self.update_ranked_variants(new_trace)
                 self.processed_traces += 1
                 if self.processed_traces == self.cut:
                     self.select_best_variants()
                     self.learn_model()
                     end = process_time()
-                    self.evaluations.append([None, None, None, end - start])
-                    start = end
+                    self.evaluations.append([None, end - self.step_start, 0.0])
+                    self.export_evaluations()
+                    self.step_start = end
                 elif self.processed_traces > self.cut:
                     stdout.write(f'\rCurrent model: {len(self.models)}\tCurrent trace: {self.processed_traces}')
                     self.evaluate_model(new_trace)
@@ -125,69 +467,202 @@ class Miner:
                         if self.best_variants.keys() != self.drift_variants[-1].keys():
                             self.learn_model()
                     end = process_time()
-                    self.evaluations[-1].append(end - start)
-                    start = end
-            elif case not in traces:
-                traces[case] = [activity]
-            elif len(traces[case]) == 1 or traces[case][-1] != activity or traces[case][-2] != activity:
-                traces[case].append(activity)
+                    self.evaluations[-1][1] = end - self.step_start
+                    self.export_evaluations()
+                    self.step_start = end
+
+    def rank_variant(self, variant):
+        """
+        Calcola la posizione di una variante secondo il criterio d'ordine selezionato. A parità di lunghezza viene
+        privilegiata la variante più frequente e, a parità di frequenza, quella osservata per prima, come in
+        Counter.most_common
+        :param variant: variante di cui calcolare la posizione
+        :return: chiave crescente con la rilevanza della variante
+        """
+        rank = (self.variants[variant], -self.variant_ids[variant])
+        if self.order == Order.FRQ:
+            return rank
+        length = self.variant_length(variant)
+        return (length if self.order == Order.MAX else -length, *rank)
+
+    def update_ranked_variants(self, variant):
+        """
+        Aggiorna incrementalmente le varianti più significative a seguito di una nuova occorrenza della variante
+        fornita. Poiché le frequenze possono soltanto aumentare, solo la variante osservata può entrare tra le prime
+        :param variant: variante di cui è stata osservata una nuova occorrenza
+        """
+        if variant not in self.ranked_variants:
+            if len(self.ranked_variants) < self.top:
+                self.ranked_variants.append(variant)
+            elif self.top > 0 and self.rank_variant(variant) > self.rank_variant(self.ranked_variants[-1]):
+                self.ranked_variants[-1] = variant
+            else:
+                return
+        self.ranked_variants.sort(key=self.rank_variant, reverse=True)
 
     def select_best_variants(self):
         """
-        Determina le varianti più significative all'istante corrente secondo il criterio d'ordine selezionato
+        Determina le varianti più significative all'istante corrente secondo il criterio d'ordine selezionato. Qualora
+        il loro numero sia determinato dalla distribuzione di Pareto, i criteri basati sulla lunghezza esaminano le
+        varianti per gruppi di pari lunghezza, ordinando per frequenza soltanto i gruppi necessari
         """
-        top_variants = self.top
-        if top_variants is None:
-            counter = 0
-            top_variants = 0
-            while counter / self.processed_traces < 0.8:
-                counter += sorted(self.variants.values(), reverse=True)[top_variants]
-                top_variants += 1
+        if self.top is not None:
+            self.best_variants = {variant: self.variants[variant] for variant in self.ranked_variants}
+            return
+        counter = 0
+        top_variants = 0
+        frequencies = sorted(self.variants.values(), reverse=True)
+        while counter / self.processed_traces < 0.8:
+            counter += frequencies[top_variants]
+            top_variants += 1
         if self.order == Order.FRQ:
-            self.best_variants = {item[0]: item[1] for item in self.variants.most_common(top_variants)}
+            self.best_variants = dict(self.variants.most_common(top_variants))
         else:
-            candidate_variants = list(item[0] for item in self.variants.most_common())
-            candidate_variants.sort(key=lambda v: len(v), reverse=self.order == Order.MAX)
-            self.best_variants = {var: self.variants[var] for var in candidate_variants[:top_variants]}
+            lengths = sorted(self.variants_by_length, reverse=self.order == Order.MAX)
+            candidate_variants = (variant for length in lengths for variant in
+                                  sorted(self.variants_by_length[length], key=self.variants.get, reverse=True))
+            self.best_variants = {var: self.variants[var] for var in islice(candidate_variants, top_variants)}
 
     def learn_model(self):
         """
-        Genera un modello di processo utilizzando le varianti più significative all'istante corrente
+        Genera un modello di processo utilizzando le varianti più significative all'istante corrente. Il modello
+        appreso in precedenza a partire dalle medesime istanze viene riutilizzato senza invocare nuovamente
+        l'algoritmo e, se richiesto, memorizzato per le esecuzioni successive con una chiave che comprende la versione
+        di pm4py e gli script di ProM impiegati. Le valutazioni ancora in attesa vengono avviate sul modello
+        precedente. In presenza di un pool di processi il modello viene appreso in background, proseguendo la lettura
+        dello stream fino alla sua prima valutazione
         """
-        log = EventLog()
-        for variant, occurrence in self.best_variants.items():
-            for i in range(occurrence if self.frequency else 1):
-                log.append(Trace({ACTIVITY_KEY: activity} for activity in variant))
-        if self.algo == Algo.IND:
-            variant = inductive_miner.Variants.IMf if self.filtering else inductive_miner.Variants.IM
-            model = inductive_miner.apply(log, variant=variant)
-        else:
-            with TemporaryDirectory() as temp:
-                log_path = path.join(temp, 'log.xes')
-                variant = xes_exporter.Variants.LINE_BY_LINE
-                xes_exporter.apply(log, log_path, variant, {variant.value.Parameters.SHOW_PROGRESS_BAR: False})
-                model_path = path.join(temp, 'model.bpmn' if self.algo == Algo.SPL else 'model.pnml')
-                script = path.join('scripts', 'run.bat' if system() == "Windows" else 'run.sh')
-                args = (script, self.algo.name, str(self.filtering), log_path, path.splitext(model_path)[0])
-                subprocess.call(args, stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
-                model = bpmn_converter.apply(read_bpmn(model_path)) if self.algo == Algo.SPL else read_pnml(model_path)
+        self.flush_evaluations()
+        training = tuple((variant, occurrence if self.frequency else 1)
+                         for variant, occurrence in self.best_variants.items())
+        model = self.learned_models.get(training)
+        if model is None:
+            traces = [(self.decode_variant(variant), occurrence) for variant, occurrence in training]
+            cache_path = None
+            if self.cache and self.algo != Algo.IND:
+                folder = path.join('results', self.log_name, 'cache')
+                makedirs(folder, exist_ok=True)
+                digest = blake2b(repr((pm4py_version, traces)).encode(), digest_size=16)
+                for tool_file in (DISCOVERY_SCRIPT, 'ProM.ini'):
+                    if path.isfile(tool_file):
+                        with open(tool_file, 'rb') as file:
+                            digest.update(file.read())
+                name = f"{self.algo.name}.{'UFL' if self.filtering else 'NFL'}.{digest.hexdigest()}.pkl"
+                cache_path = path.join(folder, name)
+            arguments = (traces, self.algo, self.filtering, cache_path)
+            if self.pool is None:
+                model = discover_model(*arguments)
+            else:
+                model = self.pool.submit(timed_discovery, *arguments)
+                self.pending_discoveries.add(model)
+            self.learned_models[training] = model
         self.models.append(model)
+        self.model_evaluations = None
         self.drift_moments.append(self.processed_traces)
         self.drift_variants.append(self.best_variants)
 
     def evaluate_model(self, trace):
         """
-        Valuta il modello di processo sull'istanza fornita in input
-        :param trace: istanza di processo da impiegare nella valutazione
+        Valuta il modello di processo sull'istanza fornita in input. Le valutazioni sono memorizzate per struttura del
+        modello e per variante, così da essere riutilizzate anche da modelli appresi nuovamente ma identici. Le
+        varianti non ancora valutate vengono valutate in blocchi di EVALUATION_BATCH, o prima se EVALUATION_BACKLOG
+        righe ne attendono il risultato
+        :param trace: istanza di processo (codificata) da impiegare nella valutazione
         """
-        log = EventLog([Trace({ACTIVITY_KEY: activity} for activity in trace)])
-        variant = fitness_evaluator.Variants.ALIGNMENT_BASED
-        fitness = fitness_evaluator.apply(log, *self.models[-1], variant=variant)['average_trace_fitness']
-        variant = precision_evaluator.Variants.ALIGN_ETCONFORMANCE
-        parameters = {variant.value.Parameters.SHOW_PROGRESS_BAR: False}
-        precision = precision_evaluator.apply(log, *self.models[-1], variant=variant, parameters=parameters)
-        f_measure = 2 * fitness * precision / (fitness + precision) if fitness != 0 else 0
-        self.evaluations.append([fitness, precision, f_measure])
+        if self.model_evaluations is None:
+            self.resolve_model()
+        evaluation = self.model_evaluations.get(trace)
+        row = [evaluation, 0.0, 0.0]
+        self.evaluations.append(row)
+        if evaluation is None:
+            row[0] = evaluation = Future()
+            self.model_evaluations[trace] = evaluation
+            self.pending_evaluations.append((trace, evaluation, row))
+        if self.pending_evaluations:
+            self.pending_rows += 1
+            if len(self.pending_evaluations) == EVALUATION_BATCH or self.pending_rows == EVALUATION_BACKLOG:
+                self.flush_evaluations()
+
+    def resolve_model(self):
+        """
+        Attende, se necessario, il modello di processo corrente appreso in background, attribuendo il tempo di CPU
+        della sua scoperta all'istanza corrente, e seleziona le valutazioni memorizzate per la sua struttura
+        """
+        self.step_start -= self.collect_model(len(self.models) - 1)
+        self.model_evaluations = self.evaluation_cache.setdefault(self.compute_model_signature(self.models[-1]), {})
+
+    def collect_model(self, index):
+        """
+        Sostituisce il modello indicizzato, se appreso in background, con il risultato della sua scoperta
+        :param index: indice del modello da raccogliere
+        :return: tempo di CPU impiegato dalla scoperta del modello, se non ancora attribuito (0 altrimenti)
+        """
+        discovery = self.models[index]
+        if not isinstance(discovery, Future):
+            return 0.0
+        self.models[index], elapsed = discovery.result()
+        if discovery not in self.pending_discoveries:
+            return 0.0
+        self.pending_discoveries.remove(discovery)
+        return elapsed
+
+    def flush_evaluations(self):
+        """
+        Valuta il modello di processo corrente sulle istanze in attesa, memorizzandone i risultati. In presenza di un
+        pool di processi la valutazione viene eseguita in background. Il tempo di CPU impiegato dal blocco è ripartito
+        tra le righe delle istanze che ne hanno richiesto la valutazione ed escluso da quello dell'istanza corrente
+        """
+        if not self.pending_evaluations:
+            return
+        traces, futures, rows = zip(*self.pending_evaluations)
+        self.pending_evaluations = []
+        self.pending_rows = 0
+        cache = self.model_evaluations
+
+        def resolve(batch):
+            try:
+                evaluations, elapsed = batch.result()
+            except Exception as error:
+                for future in futures:
+                    future.set_exception(error)
+            else:
+                for trace, future, row, evaluation in zip(traces, futures, rows, evaluations):
+                    cache[trace] = evaluation
+                    row[2] = elapsed / len(rows)
+                    future.set_result(evaluation)
+
+        arguments = ([self.decode_variant(trace) for trace in traces], self.models[-1], self.max_length)
+        if self.pool is None:
+            batch = Future()
+            batch.set_result(timed_evaluation(*arguments))
+            if self.step_start is not None:
+                self.step_start += batch.result()[1]
+            resolve(batch)
+        else:
+            self.pool.submit(timed_evaluation, *arguments).add_done_callback(resolve)
+
+    @staticmethod
+    def compute_model_signature(model):
+        """
+        Calcola una rappresentazione della struttura del modello fornito in input, indipendente dalla sua identità. Le
+        transizioni visibili sono identificate dalla propria etichetta, se unica, poiché il loro nome può variare tra
+        due scoperte dello stesso modello (l'inductive miner assegna nomi casuali); posti e transizioni invisibili sono
+        identificati dal nome. Se tali identificativi non sono univoci, il modello è rappresentato dalla sua identità
+        :param model: rete di Petri con marcatura iniziale e finale
+        :return: insiemi di nodi, archi e marcature che identificano il modello
+        """
+        net, initial_marking, final_marking = model
+        labels = Counter(transition.label for transition in net.transitions if transition.label is not None)
+        identifiers = {place: ('place', place.name) for place in net.places}
+        identifiers.update((transition, ('label', transition.label) if labels[transition.label] == 1 else
+                            ('name', transition.name, transition.label)) for transition in net.transitions)
+        nodes = frozenset(identifiers.values())
+        if len(nodes) < len(identifiers):
+            return id(model)
+        return (nodes,
+                frozenset((identifiers[arc.source], identifiers[arc.target], arc.weight) for arc in net.arcs),
+                frozenset((identifiers[place], tokens) for place, tokens in initial_marking.items()),
+                frozenset((identifiers[place], tokens) for place, tokens in final_marking.items()))
 
     def compute_model_complexity(self, index):
         """
@@ -205,66 +680,103 @@ class Miner:
             ext_card += len(successor_places)
         return len(net.places), len(net.transitions), len(net.arcs), ext_card
 
+    def export_evaluations(self, wait=False):
+        """
+        Accoda al file delle valutazioni, nell'ordine in cui sono state richieste, le valutazioni concluse e non ancora
+        esportate. Le valutazioni esportate vengono rimosse dalla memoria, conservando soltanto quanto necessario al
+        calcolo dei valori medi e totali
+        :param wait: booleano per attendere il completamento delle valutazioni eseguite in background
+        """
+        while self.evaluations:
+            evaluation = self.evaluations[0][0]
+            if isinstance(evaluation, Future):
+                if not wait and not evaluation.done():
+                    break
+                evaluation = evaluation.result()
+            _, step_time, evaluation_time = self.evaluations.popleft()
+            time = step_time + evaluation_time
+            if evaluation is not None:
+                self.exported_scores[evaluation] += 1
+            self.exported_time += time
+            self.evaluation_writer.writerow([self.exported_evaluations, *(evaluation or [None] * 3), time])
+            self.exported_evaluations += 1
+
     def save_results(self):
         """
-        Esporta report, valutazioni e modelli di processo
+        Esporta report e modelli di processo, completando il file delle valutazioni con i valori medi e totali, che
+        includono il tempo di scoperta dei modelli appresi in background e non ancora attribuito
         """
         print('\nExporting results...')
-        filtering = 'UFL' if self.filtering else 'NFL'
-        frequency = 'UFR' if self.frequency else 'NFR'
-        update = 'D' if self.update else 'S'
-        top_variants = 'P' if self.top is None else self.top
-        file = f'{self.order.name}.{self.algo.name}.{self.cut}.{top_variants}.{filtering}.{frequency}.{update}'
+        self.exported_time += sum(self.collect_model(index) for index in range(len(self.models)))
         folder = path.join('results', self.log_name, 'report')
         makedirs(folder, exist_ok=True)
         top_variants = max(len(variants.keys()) for variants in self.drift_variants)
         columns = ['trace', 'places', 'transitions', 'arcs', 'ext_cardoso',
                    *[f'trace_{i}' for i in range(1, top_variants + 1)]]
-        report = DataFrame(columns=columns)
-        report.index.name = 'n°_training'
+        rows = []
         for index, current_variants in enumerate(self.drift_variants):
-            traces = [f'[{v}]{k}' if self.order == Order.FRQ else f'[{len(k)}:{v}]{k}' for k, v in
-                      current_variants.items()] + [None] * (top_variants - len(current_variants))
-            report.loc[len(report)] = [self.drift_moments[index], *self.compute_model_complexity(index), *traces]
-        report.to_csv(path.join(folder, file + '.csv'))
-        folder = path.join('results', self.log_name, 'evaluation')
-        makedirs(folder, exist_ok=True)
-        columns = ['fitness', 'precision', 'f-measure', 'time']
-        evaluation = DataFrame(self.evaluations, columns=columns)
-        evaluation.index.name = 'n°_evaluation'
-        total_time = evaluation['time'].sum()
-        evaluation.loc['AVG'] = evaluation.mean()
-        evaluation.loc['TOT'] = [None, None, None, total_time]
-        evaluation.to_csv(path.join(folder, file + '.csv'))
+            traces = [f'[{v}]{self.decode_variant(k)}' if self.order == Order.FRQ else
+                      f'[{self.variant_length(k)}:{v}]{self.decode_variant(k)}' for k, v in current_variants.items()]
+            traces += [None] * (top_variants - len(current_variants))
+            rows.append([self.drift_moments[index], *self.compute_model_complexity(index), *traces])
+        report = DataFrame(rows, columns=columns)
+        report.index.name = 'n°_training'
+        report.to_csv(path.join(folder, self.file + '.csv'))
+        self.flush_evaluations()
+        self.export_evaluations(wait=True)
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        scores = DataFrame(list(self.exported_scores), columns=['fitness', 'precision', 'f-measure'], dtype=float)
+        weights = Series(list(self.exported_scores.values()), dtype=float)
+        averages = scores.mul(weights, axis=0).sum() / scores.notna().mul(weights, axis=0).sum()
+        averages['time'] = self.exported_time / self.exported_evaluations if self.exported_evaluations else nan
+        self.evaluation_writer.writerow(['AVG', *(None if isna(value) else value for value in averages)])
+        self.evaluation_writer.writerow(['TOT', None, None, None, self.exported_time])
+        self.evaluation_file.close()
+        replace(self.evaluation_file.name, path.join('results', self.log_name, 'evaluation', self.file + '.csv'))
         folder = path.join('results', self.log_name, 'petri')
         makedirs(folder, exist_ok=True)
         for index, model in enumerate(self.models):
             model_info = f'-{index}' if self.update else ''
-            pnml_exporter.apply(model[0], model[1], path.join(folder, file + model_info + '.pnml'), model[2])
-            pn_visualizer.save(pn_visualizer.apply(*model), path.join(folder, file + model_info + '.png'))
+            pnml_exporter.apply(model[0], model[1], path.join(folder, self.file + model_info + '.pnml'), model[2])
+            pn_visualizer.save(pn_visualizer.apply(*model), path.join(folder, self.file + model_info + '.png'))
 
     def save_variant_histogram(self, y_log=False):
         """
-        Esporta l'istogramma delle varianti di processo
+        Esporta l'istogramma delle varianti di processo, ordinate per valori decrescenti. Oltre HISTOGRAM_BARS varianti
+        l'istogramma viene tracciato come area a gradini, più rapida da disegnare di una barra per variante. La figura
+        viene creata e salvata senza ricorrere allo stato globale di pyplot. Matplotlib, non richiesto da pm4py, viene
+        importato solo al primo istogramma
         :param y_log: booleano per l'utilizzo di una scala logaritmica sull'asse delle ordinate
         """
         file = ('frequency' if self.order == Order.FRQ else 'length') + '_histogram.png'
         folder = path.join('results', self.log_name)
         makedirs(folder, exist_ok=True)
         if not path.isfile(path.join(folder, file)):
-            y_axis = self.variants.values() if self.order == Order.FRQ else [len(v) for v in self.variants.keys()]
-            pyplot.bar(range(1, len(self.variants) + 1), y_axis)
-            pyplot.title(f'Traces processed: {self.processed_traces}     Variants found: {len(self.variants)}\n')
-            pyplot.xlabel('Variants')
-            pyplot.ylabel('Frequency' if self.order == Order.FRQ else 'Length')
+            from matplotlib.figure import Figure
+            values = self.variants.values() if self.order == Order.FRQ else map(self.variant_length, self.variants)
+            y_axis = sort(fromiter(values, dtype=int, count=len(self.variants)))[::-1]
+            x_axis = arange(1, len(y_axis) + 1)
+            figure = Figure()
+            axes = figure.subplots()
+            if len(y_axis) > HISTOGRAM_BARS:
+                axes.fill_between(x_axis, y_axis, step='mid')
+            else:
+                axes.bar(x_axis, y_axis)
+            axes.set_title(f'Traces processed: {self.processed_traces}     Variants found: {len(self.variants)}\n')
+            axes.set_xlabel('Variants')
+            axes.set_ylabel('Frequency' if self.order == Order.FRQ else 'Length')
             if y_log:
-                pyplot.semilogy()
-            pyplot.savefig(path.join(folder, file))
+                axes.set_yscale('log')
+            figure.savefig(path.join(folder, file))
 
     @staticmethod
     def generate_summary(log_name):
         """
-        Genera una visualizzazione sintetica dei risultati ottenuti
+        Genera una visualizzazione sintetica dei risultati ottenuti. Di ciascun file delle valutazioni vengono lette
+        soltanto le ultime SUMMARY_TAIL posizioni, contenenti le righe dei valori medi e totali. I file temporanei di
+        esperimenti non conclusi vengono ignorati
         :param log_name: nome del log per il quale generare un sommario dei risultati
         """
         folder = path.join('results', log_name)
@@ -276,20 +788,23 @@ class Miner:
         errors = read_csv(error_file) if path.isfile(error_file) else DataFrame(columns=['algo'])
         columns = ['order', 'top-variants', 'set-up', 'fitness', 'precision', 'f-measure', 'time', 'ext_cardoso']
         for algo in Algo:
-            summary = DataFrame(columns=columns)
+            rows = []
             for error in errors.loc[errors['algo'] == algo.name].itertuples():
-                row = [error.order, error.top, f'{error.filtering} {error.frequency} {error.update}'] + ['-'] * 5
-                summary.loc[len(summary)] = row
+                setup = f'{error.filtering} {error.frequency} {error.update}'
+                rows.append([error.order, error.top, setup] + ['-'] * 5)
             for file in listdir(path.join(folder, 'evaluation')):
-                if algo.name in file:
+                if algo.name in file and file.endswith('.csv'):
                     parameters = file.split(sep='.')
-                    row = [parameters[0], parameters[3], f'{parameters[4]} {parameters[5]} {parameters[6]}']
-                    evaluation = read_csv(path.join(folder, 'evaluation', file), dtype={'n°_evaluation': 'str'})
-                    row.extend(evaluation[val][len(evaluation) - 2] for val in ('fitness', 'precision', 'f-measure'))
-                    row.append(evaluation['time'][len(evaluation) - 1])
+                    row = [parameters[0], parameters[3], ' '.join(parameters[4:-1])]
+                    with open(path.join(folder, 'evaluation', file), 'rb') as evaluation_file:
+                        evaluation_file.seek(max(0, path.getsize(evaluation_file.name) - SUMMARY_TAIL))
+                        tail = evaluation_file.read().decode('utf-8', errors='replace').splitlines()
+                    average, total = csv.reader(tail[-2:])
+                    row.extend(float(value) if value else nan for value in (*average[1:4], total[4]))
                     report = read_csv(path.join(folder, 'report', file))
                     row.append(str(report['ext_cardoso'].tolist()))
-                    summary.loc[len(summary)] = row
+                    rows.append(row)
+            summary = DataFrame(rows, columns=columns)
             summary['top-variants'] = summary['top-variants'].replace('P', -1).astype(int)
             summary = summary.sort_values(['order', 'top-variants', 'set-up'], ignore_index=True)
             summary['top-variants'] = summary['top-variants'].replace(-1, 'P')
@@ -0,0 +1,90 @@
+import csv
+import random
+import unittest
+from collections import Counter
+from os import chdir, getcwd, makedirs, path
+from tempfile import TemporaryDirectory
+
+import pm
+
+ACTIVITIES = 'ABC'
+CASES = 4
+CHUNK_SIZES = (1, 2, 3, 5, 100000)
+STREAMS = 30
+
+
+def generate_stream(seed, length=120):
+    """
+    Genera uno stream casuale di eventi con poche attività, così da produrre ripetizioni consecutive, e pochi
+    identificativi, riutilizzati da istanze diverse dopo il relativo evento finale
+    :param seed: seme del generatore casuale
+    :param length: numero di eventi dello stream
+    :return: lista di coppie formate dall'identificativo dell'istanza e dall'attività eseguita
+    """
+    generator = random.Random(seed)
+    stream, started = [], set()
+    for i in range(length):
+        case = f'c{generator.randrange(CASES)}'
+        if case in started and generator.random() < 0.25:
+            activity = pm.FINAL_ACTIVITY
+            started.remove(case)
+        else:
+            activity = generator.choice(ACTIVITIES)
+            started.add(case)
+        stream.append((case, activity))
+    return stream
+
+
+def count_variants(stream):
+    """
+    Conta le varianti dello stream evento per evento, secondo la regola originale di process_stream
+    :param stream: lista di coppie formate dall'identificativo dell'istanza e dall'attività eseguita
+    :return: contatore delle varianti completate
+    """
+    variants, traces = Counter(), {}
+    for case, activity in stream:
+        if activity == pm.FINAL_ACTIVITY:
+            variants[tuple(traces.pop(case))] += 1
+        elif case not in traces:
+            traces[case] = [activity]
+        elif len(traces[case]) == 1 or traces[case][-1] != activity or traces[case][-2] != activity:
+            traces[case].append(activity)
+    return variants
+
+
+class SegmentationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.cwd = getcwd()
+        self.chunk_size = pm.CHUNK_SIZE
+        chdir(self.directory.name)
+        makedirs(path.join('eventlog', 'CSV'))
+
+    def tearDown(self):
+        pm.CHUNK_SIZE = self.chunk_size
+        chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_variants_match_event_loop(self):
+        for seed in range(STREAMS):
+            stream = generate_stream(seed)
+            with open(path.join('eventlog', 'CSV', 'stream.csv'), 'w', encoding='utf-8', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow((pm.ACTIVITY_KEY, pm.CASE_ID_KEY))
+                writer.writerows((activity, case) for case, activity in stream)
+            expected = count_variants(stream)
+            for chunk_size in CHUNK_SIZES:
+                with self.subTest(seed=seed, chunk_size=chunk_size):
+                    pm.CHUNK_SIZE = chunk_size
+                    miner = pm.Miner('stream', pm.Order.FRQ, pm.Algo.IND, cut=len(stream) + 1, top=1,
+                                     filtering=False, frequency=False, update=False)
+                    miner.process_stream()
+                    miner.evaluation_file.close()
+                    variants = Counter({miner.decode_variant(variant): count
+                                        for variant, count in miner.variants.items()})
+                    self.assertEqual(variants, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()